@@ -1,20 +1,42 @@
 import os
 import asyncio
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+import json
+import pickle
+import shutil
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from contextlib import asynccontextmanager, suppress
+from typing import Optional
+from fastapi import FastAPI, Depends, UploadFile, File
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
 from dotenv import load_dotenv
-from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 
+from config import Config
+from history_cache import HistoryCache
+
+# SQLAlchemy imports
+from sqlalchemy import String, Text, DateTime, ForeignKey, Index, event, func, select, delete
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+
 # LangChain imports
 from langchain_groq import ChatGroq
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
 from langchain_community.document_loaders import PyPDFLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+import faiss
+import httpx
+import numpy as np
+from filelock import FileLock
+
 import logging
+import threading
 import uuid
 from werkzeug.utils import secure_filename
 
@@ -25,196 +47,863 @@ logger = logging.getLogger(__name__)
 # Load env variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-
 # Database Setup
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbot.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# Keep using the SQLite file Flask-SQLAlchemy created under instance/
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INSTANCE_DIR = os.path.join(BASE_DIR, 'instance')
+os.makedirs(INSTANCE_DIR, exist_ok=True)
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"sqlite+aiosqlite:///{os.path.join(INSTANCE_DIR, 'chatbot.db')}",
+)
+# A larger compiled-statement cache keeps the hot-path SELECT/INSERTs compiled across requests
+engine = create_async_engine(DATABASE_URL, query_cache_size=1200)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL + synchronous=NORMAL: commits no longer fsync the main database file
+    # and readers don't block behind the writer
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+class Base(DeclarativeBase):
+    pass
 
 # Models
-class ChatSession(db.Model):
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    title = db.Column(db.String(255), default="New Chat")
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    messages = db.relationship('Message', backref='session', lazy=True, cascade="all, delete-orphan")
-
-class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    session_id = db.Column(db.String(36), db.ForeignKey('chat_session.id'), nullable=False)
-    role = db.Column(db.String(20), nullable=False) # 'user' or 'assistant'
-    content = db.Column(db.Text, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+class ChatSession(Base):
+    __tablename__ = 'chat_session'
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    title: Mapped[Optional[str]] = mapped_column(String(255), default="New Chat")
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+
+class Message(Base):
+    __tablename__ = 'message'
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    session_id: Mapped[str] = mapped_column(String(36), ForeignKey('chat_session.id'), nullable=False)
+    role: Mapped[str] = mapped_column(String(20), nullable=False) # 'user' or 'assistant'
+    content: Mapped[str] = mapped_column(Text, nullable=False)
+    created_at: Mapped[Optional[datetime]] = mapped_column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_msg_session_created', 'session_id', 'created_at'),
+    )
+
+def create_schema(conn):
+    Base.metadata.create_all(conn)
+    # create_all skips tables that already exist, so add the history index to
+    # databases created before it was introduced
+    for index in Message.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+async def get_db():
+    async with SessionLocal() as session:
+        yield session
+
+# Request models
+class ChatRequest(BaseModel):
+    message: Optional[str] = None
+    sessionId: Optional[str] = None
 
 # Groq model initialization
+# One pooled HTTP/2 client for every LLM call, so requests reuse warm
+# connections to the Groq API instead of paying TCP + TLS setup each time
+groq_http_client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=100, max_connections=200),
+    timeout=60,
+)
+
 try:
     llm = ChatGroq(
         api_key=os.getenv("GROQ_API_KEY"),
         model=os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile"),
         temperature=0.7,
         max_retries=2,
+        http_async_client=groq_http_client,
     )
 except Exception as e:
     logger.error(f"Failed to initialize Groq LLM: {str(e)}")
     llm = None
 
 # RAG Setup
-embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-vector_store = None
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# "torch" runs the FP32 PyTorch model (on GPU when available); "onnx" runs an
+# int8-quantized ONNX export on CPU (see onnx_embeddings.py). Vectors from the
+# two backends are close but not identical, so rebuild the FAISS index after
+# switching for best recall.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+_embeddings_singleton = None
+_embeddings_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def embedding_device():
+    # NVML-based probe: answers without initializing CUDA, so the gunicorn
+    # master can ask before deciding whether it may preload the model
+    os.environ.setdefault("PYTORCH_NVML_BASED_CUDA_CHECK", "1")
+    import torch
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+def can_preload_embeddings():
+    """Whether the model may be loaded before fork (see gunicorn.conf.py).
+
+    CUDA can't be re-initialized in a forked child, so a GPU model has to be
+    loaded by each worker instead.
+    """
+    return EMBEDDING_BACKEND == "torch" and embedding_device() == "cpu"
+
+def load_embeddings():
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings(
+            EMBEDDING_MODEL,
+            cache_dir=os.path.join(INSTANCE_DIR, 'onnx', EMBEDDING_MODEL.split('/')[-1]),
+            batch_size=EMBEDDING_BATCH_SIZE,
+        )
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL,
+        model_kwargs={"device": embedding_device()},
+        encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE, "normalize_embeddings": True},
+    )
+
+def get_embeddings():
+    """Load the embedding model on first use and share it afterwards.
+
+    Under gunicorn (see gunicorn.conf.py) a CPU model is loaded once in the
+    master before workers are forked, so they share its pages copy-on-write;
+    otherwise each worker loads it from the lifespan handler.
+    """
+    global _embeddings_singleton
+    if _embeddings_singleton is None:
+        with _embeddings_lock:
+            if _embeddings_singleton is None:
+                _embeddings_singleton = load_embeddings()
+    return _embeddings_singleton
+
+# FAISS index layout. The default (empty FAISS_INDEX_FACTORY) is an HNSW graph
+# over 8-bit scalar-quantized vectors, 384 bytes each (a quarter of float32).
+# Embeddings are L2-normalized, so every component lies in [-1, 1]: the
+# quantizer is trained once on those fixed bounds and its precision doesn't
+# depend on whatever happened to be uploaded first. Any index_factory string
+# can be set instead; data-trained codecs ("HNSW32,SQ8", "IVF256,PQ48x8", ...)
+# learn their ranges/codebooks from the first upload, which must then hold at
+# least FAISS_MIN_TRAIN_VECTORS chunks (and, for IVF, well over the number of
+# lists).
+EMBEDDING_DIM = 384
+FAISS_INDEX_FACTORY = os.getenv("FAISS_INDEX_FACTORY", "")
+FAISS_MIN_TRAIN_VECTORS = int(os.getenv("FAISS_MIN_TRAIN_VECTORS", "1000"))
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))
+# Document chunking, measured in MiniLM word pieces. The encoder truncates its
+# input at 256 tokens ([CLS]/[SEP] included), so longer chunks would be
+# embedded from their first ~250 tokens only.
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "250"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+
+@lru_cache(maxsize=1)
+def get_text_splitter():
+    from transformers import AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(EMBEDDING_MODEL)
+    return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer, chunk_size=CHUNK_TOKENS, chunk_overlap=CHUNK_OVERLAP_TOKENS
+    )
+
+# On-disk RAG index, kept under instance/ rather than uploads/ so an upload
+# can't overwrite it
+FAISS_DIR = os.path.join(INSTANCE_DIR, 'faiss')
+# How often (seconds) a worker looks for an index written by another worker
+INDEX_VERSION_CHECK_INTERVAL = float(os.getenv("INDEX_VERSION_CHECK_MS", "500")) / 1000
 UPLOAD_FOLDER = 'uploads'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-SYSTEM_PROMPT = "You are a helpful assistant. Keep your responses concise and friendly."
+# Query embedding cache. The salt is part of every key so that switching the
+# encoder (or its settings) can never serve vectors from the previous one.
+EMBEDDING_CACHE_SALT = f"{EMBEDDING_MODEL}:{EMBEDDING_BACKEND}:normalized:v1"
+
+@lru_cache(maxsize=4096)
+def _embed_query_cached(salt, text):
+    return np.asarray(get_embeddings().embed_query(text), dtype='float32').tobytes()
+
+def embed_query(text):
+    # MiniLM's tokenizer is uncased and ignores runs of whitespace, so
+    # normalizing the key this way doesn't change the resulting vector
+    key = " ".join(text.split()).lower()
+    return np.frombuffer(_embed_query_cached(EMBEDDING_CACHE_SALT, key), dtype='float32')
+
+SYSTEM_PROMPT = Config.SYSTEM_PROMPT
+# Shared by every prompt and never modified (see prepare_turn)
+SYSTEM_MESSAGE = SystemMessage(content=SYSTEM_PROMPT)
+# Maximum number of recent messages replayed to the LLM each turn. The window
+# slides in blocks: once it overflows, the oldest messages are dropped down to
+# CTX_TURNS // 2, so the history prefix stays identical for several turns.
+CTX_TURNS = int(os.getenv('CTX_TURNS', '12'))
+
+# Semantic response cache
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "3600"))
+SEMANTIC_CACHE_SESSIONS = int(os.getenv("SEMANTIC_CACHE_SESSIONS", "1024"))
+
+class SemanticCache:
+    """Per-session cache of answers keyed by the embedding of the prompt.
+
+    Prompts are compared by cosine similarity (inner product of L2-normalized
+    vectors), so paraphrases of an earlier question reuse its answer instead of
+    paying for another LLM round-trip. Answers depend on the conversation, so
+    each session's entries are tagged with the id of the last message they
+    were answered after, and a lookup only hits while the session's history
+    still ends at that message. Callers evict a session whenever its history
+    gains a turn that wasn't a cache hit, and `advance` the tag past turns
+    that were. A session's entries expire together `ttl` seconds after its
+    first cached answer, and least recently used sessions are dropped beyond
+    `max_sessions`.
+    """
+
+    def __init__(self, dim, threshold, ttl, max_sessions):
+        self.dim = dim
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+
+    def _get(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry and time.monotonic() > entry["expires_at"]:
+            del self._sessions[session_id]
+            return None
+        if entry:
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def lookup(self, session_id, vec, history_id):
+        entry = self._get(session_id)
+        if not entry:
+            return None
+        if entry["history_id"] != history_id:
+            # The history moved on elsewhere (another worker, or a write this
+            # worker didn't answer), so none of the answers can be trusted
+            del self._sessions[session_id]
+            return None
+        scores, ids = entry["index"].search(vec, 1)
+        if ids[0, 0] >= 0 and scores[0, 0] > self.threshold:
+            return entry["responses"][ids[0, 0]]
+        return None
+
+    def add(self, session_id, vec, response, history_id):
+        entry = self._get(session_id)
+        if entry and entry["history_id"] != history_id:
+            del self._sessions[session_id]
+            entry = None
+        if not entry:
+            entry = self._sessions[session_id] = {
+                "index": faiss.IndexFlatIP(self.dim),
+                "responses": [],
+                "history_id": history_id,
+                "expires_at": time.monotonic() + self.ttl,
+            }
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        entry["index"].add(vec)
+        entry["responses"].append(response)
+
+    def advance(self, session_id, history_id, last_id):
+        # Move the tag past a turn appended directly after `history_id`
+        entry = self._sessions.get(session_id)
+        if entry and entry["history_id"] == history_id:
+            entry["history_id"] = last_id
+
+    def evict(self, session_id):
+        self._sessions.pop(session_id, None)
+
+    def clear(self):
+        self._sessions.clear()
+
+semantic_cache = SemanticCache(
+    EMBEDDING_DIM, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_SESSIONS
+)
+
+# Prompt history cache
+HISTORY_CACHE_SESSIONS = int(os.getenv("HISTORY_CACHE_SESSIONS", "1024"))
+
+history_cache = HistoryCache(CTX_TURNS, HISTORY_CACHE_SESSIONS)
+
+def to_prompt_message(role, content):
+    return HumanMessage(content=content) if role == 'user' else AIMessage(content=content)
+
+# RAG retrieval
+RAG_TOP_K = 3
+RAG_BATCH_WINDOW = float(os.getenv("RAG_BATCH_WINDOW_MS", "5")) / 1000
+
+def new_index():
+    if FAISS_INDEX_FACTORY:
+        index = faiss.index_factory(EMBEDDING_DIM, FAISS_INDEX_FACTORY)
+    else:
+        index = faiss.IndexHNSWSQ(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit_uniform, 32)
+        index.train(np.array([[-1.0] * EMBEDDING_DIM, [1.0] * EMBEDDING_DIM], dtype='float32'))
+    tune_index(index)
+    return index
+
+def tune_index(index):
+    if hasattr(index, "hnsw"):
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = FAISS_NPROBE
+
+def replace_file(path, write):
+    # Write next to the target and rename over it, so readers that still have
+    # the old file mapped keep a consistent copy
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+class IndexHandle:
+    """The RAG index shared by every request and every worker process.
+
+    The FAISS index and its docstore (FAISS id -> Document) are only ever
+    replaced, never mutated in place: a writer builds a new index from the
+    latest on-disk copy, persists it, bumps the version file and then swaps
+    the in-memory references under `_lock`. Readers take a snapshot of both
+    references and search it without holding any lock, so an upload can't
+    tear a concurrent search. Other workers notice the new version on their
+    next request and reopen the index with its vector codes memory-mapped.
+
+    Each upload costs O(corpus): the writer re-reads the whole index and
+    docstore, then rewrites both, all under the global file lock. That keeps
+    every worker's copy consistent without a server process and is cheap at
+    the scale of a few hundred documents. A large corpus would need
+    incremental appends (e.g. on-disk IVF lists) instead.
+    """
+
+    def __init__(self, directory, check_interval):
+        os.makedirs(directory, exist_ok=True)
+        self.check_interval = check_interval
+        self.index_path = os.path.join(directory, 'index.faiss')
+        self.docstore_path = os.path.join(directory, 'docstore.pkl')
+        self.version_path = os.path.join(directory, 'version')
+        # Serializes writers across processes; _lock guards the swap in-process
+        self._file_lock = FileLock(os.path.join(directory, 'index.lock'))
+        self._lock = threading.RLock()
+        self.index = None
+        self.docstore = {}
+        self.version = 0
+        self._disk_version = 0
+        self._checked_at = float('-inf')
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def snapshot(self):
+        with self._lock:
+            return self.index, self.docstore
+
+    def read_version(self):
+        try:
+            with open(self.version_path) as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def is_stale(self):
+        # Called on the event loop for every chat turn, so the version file is
+        # read at most once per check_interval; in between, the last answer
+        # stands (a new upload shows up within that delay)
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval:
+            self._checked_at = now
+            self._disk_version = self.read_version()
+        return self._disk_version != self.version
+
+    def _load(self, mmap):
+        # IO_FLAG_MMAP_IFC maps the flat code arrays (the bulk of an HNSW/SQ
+        # index) from the file instead of copying them onto the heap, so
+        # workers on the same host share them through the page cache. The
+        # HNSW graph links are still read into memory. Plain IO_FLAG_MMAP
+        # would only affect IVF inverted lists.
+        index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP_IFC if mmap else 0)
+        tune_index(index)
+        with open(self.docstore_path, 'rb') as f:
+            docstore = pickle.load(f)
+        return index, docstore
+
+    def refresh(self):
+        """Reopen the on-disk index if it is newer than the one loaded here."""
+        with self._file_lock, self._lock:
+            version = self.read_version()
+            if version != self.version and os.path.exists(self.index_path):
+                self.index, self.docstore = self._load(mmap=True)
+                self.version = version
+                logger.info(f"Loaded FAISS index version {version}")
+
+    def add(self, documents, vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        with self._file_lock:
+            # Start from the latest on-disk copy (opened writable) so documents
+            # added by other workers are kept
+            if os.path.exists(self.index_path):
+                index, docstore = self._load(mmap=False)
+                docstore = dict(docstore)
+            else:
+                # Sub-linear, compressed search instead of brute-force IndexFlatL2
+                index = new_index()
+                docstore = {}
+            if not index.is_trained:
+                # Training happens once; a small sample would fix ranges that
+                # clamp or collapse every vector added later
+                if len(vectors) < FAISS_MIN_TRAIN_VECTORS:
+                    raise ValueError(
+                        f"Index '{FAISS_INDEX_FACTORY}' needs at least {FAISS_MIN_TRAIN_VECTORS} "
+                        f"chunks to train, got {len(vectors)}; upload a larger first document "
+                        "or leave FAISS_INDEX_FACTORY unset for the default index"
+                    )
+                index.train(vectors)
+            start = index.ntotal
+            index.add(vectors)
+            docstore.update(zip(range(start, index.ntotal), documents))
+
+            version = self.read_version() + 1
+
+            def write_docstore(path):
+                with open(path, 'wb') as f:
+                    pickle.dump(docstore, f)
+
+            def write_version(path):
+                with open(path, 'w') as f:
+                    f.write(str(version))
+
+            replace_file(self.index_path, lambda path: faiss.write_index(index, path))
+            replace_file(self.docstore_path, write_docstore)
+            replace_file(self.version_path, write_version)
+
+            with self._lock:
+                self.index, self.docstore, self.version = index, docstore, version
 
-with app.app_context():
-    db.create_all()
+    def search(self, queries, k):
+        """Run one FAISS search for a (B, dim) query matrix; returns B lists of chunk texts."""
+        index, docstore = self.snapshot()
+        if index is None:
+            return [[] for _ in range(len(queries))]
+        _, ids = index.search(queries, k)
+        return [[docstore[i].page_content for i in row if i != -1] for row in ids]
 
-def get_rag_context(query):
-    global vector_store
-    if vector_store:
-        docs = vector_store.similarity_search(query, k=3)
-        return "\n\n".join([doc.page_content for doc in docs])
+index_handle = IndexHandle(FAISS_DIR, INDEX_VERSION_CHECK_INTERVAL)
+
+class SearchBatcher:
+    """Coalesces RAG queries from concurrent requests into batched FAISS searches.
+
+    A single worker task takes the first queued query, keeps collecting for
+    up to `window` seconds, then searches the whole (B, dim) matrix in one call
+    on a thread (FAISS releases the GIL) and resolves each caller's future.
+    """
+
+    def __init__(self, k, window):
+        self.k = k
+        self.window = window
+        self._queue = None
+        self._worker = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker:
+            self._worker.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._worker
+
+    async def submit(self, vec):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((vec, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while (timeout := deadline - loop.time()) > 0:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            futures = [future for _, future in batch]
+            queries = np.asarray([vec for vec, _ in batch], dtype='float32')
+            try:
+                results = await asyncio.to_thread(index_handle.search, queries, self.k)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for future, texts in zip(futures, results):
+                if not future.done():
+                    future.set_result(texts)
+
+rag_batcher = SearchBatcher(RAG_TOP_K, RAG_BATCH_WINDOW)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+    # Warm the model before serving; a no-op if gunicorn already preloaded it
+    await asyncio.to_thread(get_embeddings)
+    await asyncio.to_thread(index_handle.refresh)
+    rag_batcher.start()
+    yield
+    await rag_batcher.stop()
+    await groq_http_client.aclose()
+    if pending_writes:
+        await asyncio.wait(list(pending_writes.values()))
+    await engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# Chat turns whose commit is still in flight, by session. The HTTP response is
+# sent before the turn is committed; the next request for the same session
+# waits on this so it still reads its own writes.
+pending_writes = {}
+
+async def save_turn(session_id, user_message, user_created_at, assistant_message, assistant_created_at, previous=None):
+    if previous:
+        await asyncio.wait([previous])
+    async with SessionLocal() as db:
+        user_row = Message(session_id=session_id, role='user', content=user_message, created_at=user_created_at)
+        assistant_row = Message(session_id=session_id, role='assistant', content=assistant_message, created_at=assistant_created_at)
+        db.add_all([user_row, assistant_row])
+        await db.flush()
+        # Ids are assigned under SQLite's write lock, so this is the message
+        # the turn was appended after, whichever worker wrote it
+        previous_id = await db.scalar(
+            select(func.max(Message.id)).where(Message.session_id == session_id, Message.id < user_row.id)
+        )
+        await db.commit()
+    return previous_id, assistant_row.id
+
+def schedule_save_turn(session_id, user_message, user_created_at, assistant_message, assistant_created_at):
+    task = asyncio.create_task(save_turn(
+        session_id, user_message, user_created_at, assistant_message, assistant_created_at,
+        pending_writes.get(session_id),
+    ))
+    pending_writes[session_id] = task
+
+    def on_done(t):
+        if pending_writes.get(session_id) is t:
+            del pending_writes[session_id]
+        if not t.cancelled() and t.exception():
+            logger.error(f"Failed to save chat turn: {t.exception()}")
+
+    task.add_done_callback(on_done)
+    return task
+
+async def wait_for_pending_writes(session_id):
+    task = pending_writes.get(session_id)
+    if task:
+        await asyncio.wait([task])
+
+async def get_rag_context(query_embedding):
+    if index_handle.ready:
+        texts = await rag_batcher.submit(query_embedding)
+        return "\n\n".join(texts)
     return ""
 
-async def get_assistant_response(user_message, session_id):
-    if not llm:
-        raise ValueError("LLM not initialized properly.")
-    
-    # Fetch history from DB
-    history = Message.query.filter_by(session_id=session_id).order_by(Message.created_at).all()
-    
-    messages = [SystemMessage(content=SYSTEM_PROMPT)]
-    
+class ChatTurn:
+    """One user message being answered: either a cached answer or the prompt to send."""
+
+    def __init__(self, session_id, user_message):
+        self.session_id = session_id
+        self.user_message = user_message
+        self.created_at = datetime.utcnow()
+        self.cache_vec = None
+        self.history_id = None
+        self.cached = None
+        self.messages = None
+
+    def finish(self, response, cache=True):
+        # Save both messages to DB in one commit, off the response path. The
+        # next turn picks them up from the DB through the history cache's
+        # id cursor once committed.
+        task = schedule_save_turn(self.session_id, self.user_message, self.created_at, response, datetime.utcnow())
+        if self.cached is None:
+            # The conversation moved on, so earlier cached answers may no
+            # longer hold ("what is my name?" before and after "I'm Bob")
+            semantic_cache.evict(self.session_id)
+            if cache:
+                semantic_cache.add(self.session_id, self.cache_vec, response, self.history_id)
+
+        # Once committed, the session's history ends at this turn; the cached
+        # answers still hold if nothing else was appended in between
+        def on_saved(t):
+            if t.cancelled() or t.exception():
+                return
+            previous_id, last_id = t.result()
+            if previous_id == self.history_id:
+                semantic_cache.advance(self.session_id, self.history_id, last_id)
+
+        task.add_done_callback(on_saved)
+
+async def prepare_turn(db: AsyncSession, user_message, session_id):
+    turn = ChatTurn(session_id, user_message)
+
+    # Pick up documents indexed by other workers
+    if index_handle.is_stale():
+        await asyncio.to_thread(index_handle.refresh)
+        semantic_cache.clear()
+
+    # Embed once; the vector serves both the semantic cache and RAG retrieval
+    query_embedding = await asyncio.to_thread(embed_query, user_message)
+    turn.cache_vec = np.asarray([query_embedding], dtype='float32')
+    faiss.normalize_L2(turn.cache_vec)
+
+    # Fetch history: the whole window on a cache miss, otherwise only rows
+    # committed since the cached ones (this worker's previous turn, or turns
+    # from other workers). Only the last CTX_TURNS messages, as plain rows:
+    # no ORM objects to hydrate, and prompt size stays flat as the session grows.
+    # This runs before the semantic cache lookup, which needs the id of the
+    # session's latest message to tell whether its answers still hold.
+    await wait_for_pending_writes(session_id)
+    cached_history = history_cache.get(session_id)
+    query = select(Message.id, Message.role, Message.content).where(Message.session_id == session_id)
+    if cached_history and cached_history["last_id"] is not None:
+        query = query.where(Message.id > cached_history["last_id"]).order_by(Message.id.desc())
+    else:
+        query = query.order_by(Message.created_at.desc())
+    result = await db.execute(query.limit(CTX_TURNS))
+    rows = result.all()[::-1]
+    history_cache.extend(session_id, [(row.id, to_prompt_message(row.role, row.content)) for row in rows])
+    turn.history_id = history_cache.get(session_id)["last_id"]
+
+    turn.cached = semantic_cache.lookup(session_id, turn.cache_vec, turn.history_id)
+    if turn.cached is not None:
+        return turn
+
+    # Prompt layout: [system prompt, history..., RAG context, user message].
+    # The system prompt and history form a prefix that is only appended to
+    # between turns, except when the history window slides; since it slides in
+    # blocks of CTX_TURNS // 2, the prefix is reused for several consecutive
+    # turns and can hit provider-side prompt caching. Anything that changes
+    # per request (retrieved context, the new message) must go after the
+    # history, never into the system prompt.
+    messages = [SYSTEM_MESSAGE, *history_cache.get(session_id)["messages"]]
+
     # Add RAG context if available
-    context = get_rag_context(user_message)
+    context = await get_rag_context(query_embedding)
     if context:
-        context_prompt = f"\n\nContext from uploaded documents:\n{context}"
-        messages[0].content += context_prompt
-
-    # Add history
-    for msg in history:
-        if msg.role == 'user':
-            messages.append(HumanMessage(content=msg.content))
-        else:
-            messages.append(AIMessage(content=msg.content))
-            
+        messages.append(SystemMessage(content=f"Context from uploaded documents:\n{context}"))
+
     # Add current message
     messages.append(HumanMessage(content=user_message))
-    
-    # Save user message to DB
-    user_msg = Message(session_id=session_id, role='user', content=user_message)
-    db.session.add(user_msg)
-    
+    turn.messages = messages
+    return turn
+
+async def get_assistant_response(db: AsyncSession, user_message, session_id):
+    if not llm:
+        raise ValueError("LLM not initialized properly.")
+
+    turn = await prepare_turn(db, user_message, session_id)
+    if turn.cached is not None:
+        turn.finish(turn.cached)
+        return turn.cached
+
     # Invoke AI
-    response = await llm.ainvoke(messages)
-    
-    # Save AI response to DB
-    ai_msg = Message(session_id=session_id, role='assistant', content=response.content)
-    db.session.add(ai_msg)
-    db.session.commit()
-    
+    response = await llm.ainvoke(turn.messages)
+    turn.finish(response.content)
     return response.content
 
-@app.route("/sessions", methods=["GET"])
-def get_sessions():
-    sessions = ChatSession.query.order_by(ChatSession.created_at.desc()).all()
-    return jsonify([{
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def stream_assistant_response(turn):
+    if turn.cached is not None:
+        turn.finish(turn.cached)
+        yield sse_event({"token": turn.cached})
+        yield sse_event({"done": True})
+        return
+
+    chunks = []
+    completed = False
+    try:
+        async for chunk in llm.astream(turn.messages):
+            if chunk.content:
+                chunks.append(chunk.content)
+                yield sse_event({"token": chunk.content})
+        completed = True
+        yield sse_event({"done": True})
+    except Exception as e:
+        logger.error(f"Chat stream error: {str(e)}")
+        yield sse_event({"error": str(e)})
+    finally:
+        # Also reached when the client disconnects mid-stream; finish() only
+        # schedules the write, so it survives this generator being cancelled.
+        # Partial answers are kept in the history but never cached.
+        if chunks:
+            turn.finish("".join(chunks), cache=completed)
+
+@app.get("/sessions")
+async def get_sessions(db: AsyncSession = Depends(get_db)):
+    result = await db.execute(select(ChatSession).order_by(ChatSession.created_at.desc()))
+    sessions = result.scalars().all()
+    return [{
         "id": s.id,
         "title": s.title,
         "created_at": s.created_at.isoformat()
-    } for s in sessions])
+    } for s in sessions]
 
-@app.route("/sessions", methods=["POST"])
-def create_session():
+@app.post("/sessions")
+async def create_session(db: AsyncSession = Depends(get_db)):
     new_session = ChatSession(title="New Chat")
-    db.session.add(new_session)
-    db.session.commit()
-    return jsonify({"id": new_session.id, "title": new_session.title})
+    db.add(new_session)
+    await db.commit()
+    return {"id": new_session.id, "title": new_session.title}
 
-@app.route("/sessions/<session_id>", methods=["DELETE"])
-def delete_session(session_id):
-    session = ChatSession.query.get(session_id)
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, db: AsyncSession = Depends(get_db)):
+    await wait_for_pending_writes(session_id)
+    session = await db.get(ChatSession, session_id)
     if not session:
-        return jsonify({"error": "Session not found"}), 404
-    db.session.delete(session)
-    db.session.commit()
-    return jsonify({"status": "deleted"})
-
-@app.route("/sessions/<session_id>/messages", methods=["GET"])
-def get_messages(session_id):
-    messages = Message.query.filter_by(session_id=session_id).order_by(Message.created_at).all()
-    return jsonify([{
+        return JSONResponse({"error": "Session not found"}, status_code=404)
+    await db.execute(delete(Message).where(Message.session_id == session_id))
+    await db.delete(session)
+    await db.commit()
+    semantic_cache.evict(session_id)
+    history_cache.evict(session_id)
+    return {"status": "deleted"}
+
+@app.get("/sessions/{session_id}/messages")
+async def get_messages(session_id: str, db: AsyncSession = Depends(get_db)):
+    await wait_for_pending_writes(session_id)
+    result = await db.execute(
+        select(Message.role, Message.content, Message.created_at)
+        .where(Message.session_id == session_id)
+        .order_by(Message.created_at)
+    )
+    messages = result.all()
+    return [{
         "role": m.role,
         "content": m.content,
         "created_at": m.created_at.isoformat()
-    } for m in messages])
+    } for m in messages]
 
-@app.route("/chat", methods=["POST"])
-def chat():
+@app.post("/chat")
+async def chat(data: ChatRequest, db: AsyncSession = Depends(get_db)):
     try:
-        data = request.get_json()
-        user_message = data.get("message")
-        session_id = data.get("sessionId")
+        user_message = data.message
+        session_id = data.sessionId
 
         if not user_message or not session_id:
-            return jsonify({"error": "Message or sessionId missing"}), 400
+            return JSONResponse({"error": "Message or sessionId missing"}, status_code=400)
+
+        response = await get_assistant_response(db, user_message, session_id)
+        return {"response": response}
+
+    except Exception as e:
+        logger.error(f"Chat error: {str(e)}")
+        return JSONResponse({"error": str(e)}, status_code=500)
 
-        # Run async function
-        response = asyncio.run(get_assistant_response(user_message, session_id))
-        return jsonify({"response": response})
+@app.post("/chat/stream")
+async def chat_stream(data: ChatRequest, db: AsyncSession = Depends(get_db)):
+    user_message = data.message
+    session_id = data.sessionId
 
+    if not user_message or not session_id:
+        return JSONResponse({"error": "Message or sessionId missing"}, status_code=400)
+
+    try:
+        if not llm:
+            raise ValueError("LLM not initialized properly.")
+        turn = await prepare_turn(db, user_message, session_id)
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
-        return jsonify({"error": str(e)}), 500
-
-@app.route("/upload", methods=["POST"])
-def upload_file():
-    global vector_store
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files['file']
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+    return StreamingResponse(
+        stream_assistant_response(turn),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def index_file(filepath, filename):
+    if filename.lower().endswith('.pdf'):
+        loader = PyPDFLoader(filepath)
+        documents = loader.load()
+    else:
+        with open(filepath, 'r', encoding='utf-8-sig') as f:
+            text = f.read()
+        from langchain_core.documents import Document
+        documents = [Document(page_content=text, metadata={"source": filename})]
+
+    splits = get_text_splitter().split_documents(documents)
+    if not splits:
+        raise ValueError("No text found in file")
+
+    # One batched encoder pass over all chunks, then a single index insert
+    texts = [split.page_content for split in splits]
+    vectors = get_embeddings().embed_documents(texts)
+    index_handle.add(splits, vectors)
+
+def save_upload(file, filepath):
+    # Copy in chunks from the spooled upload, so large files are never held
+    # in memory whole
+    with open(filepath, 'wb') as f:
+        shutil.copyfileobj(file.file, f)
+
+@app.post("/upload")
+async def upload_file(file: Optional[UploadFile] = File(None)):
+    if file is None:
+        return JSONResponse({"error": "No file part"}, status_code=400)
+
     if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
-    
-    if file:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
-        
-        # Index the file
-        try:
-            filepath = os.path.abspath(filepath)
-            logger.info(f"Indexing file: {filepath}")
-            
-            if filename.lower().endswith('.pdf'):
-                loader = PyPDFLoader(filepath)
-                documents = loader.load()
-            else:
-                with open(filepath, 'r', encoding='utf-8-sig') as f:
-                    text = f.read()
-                from langchain_core.documents import Document
-                documents = [Document(page_content=text, metadata={"source": filename})]
-                
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            splits = text_splitter.split_documents(documents)
-            
-            if vector_store:
-                vector_store.add_documents(splits)
-            else:
-                vector_store = FAISS.from_documents(splits, embeddings)
-                
-            return jsonify({"message": f"File {filename} indexed successfully"})
-        except Exception as e:
-            import traceback
-            logger.error(f"Indexing error: {str(e)}")
-            logger.error(traceback.format_exc())
-            return jsonify({"error": f"Failed to index: {str(e)}"}), 500
-
-@app.route("/health")
-def health():
-    return jsonify({"status": "ok", "db": "operational", "rag_ready": vector_store is not None})
+        return JSONResponse({"error": "No selected file"}, status_code=400)
+
+    filename = secure_filename(file.filename)
+    filepath = os.path.join(UPLOAD_FOLDER, filename)
+    await asyncio.to_thread(save_upload, file, filepath)
+
+    # Index the file
+    try:
+        filepath = os.path.abspath(filepath)
+        logger.info(f"Indexing file: {filepath}")
+        # Loading, splitting and embedding are CPU-bound; keep them off the event loop
+        await asyncio.to_thread(index_file, filepath, filename)
+        # Cached answers were produced without the new document's context
+        semantic_cache.clear()
+        return {"message": f"File {filename} indexed successfully"}
+    except Exception as e:
+        import traceback
+        logger.error(f"Indexing error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse({"error": f"Failed to index: {str(e)}"}, status_code=500)
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "db": "operational", "rag_ready": index_handle.ready}
 
 if __name__ == "__main__":
-    app.run(port=5000, debug=True)
\ No newline at end of file
+    import importlib.util
+    import uvicorn
+    # uvloop is not available on Windows; fall back to the stock asyncio loop there
+    loop = "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+    uvicorn.run("app:app", port=5000, reload=True, loop=loop)
@@ -8,6 +8,7 @@ class Config:
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
     GROQ_API_KEY = os.getenv('GROQ_API_KEY')
     GROQ_MODEL = os.getenv('GROQ_MODEL', 'llama-3.3-70b-versatile')
+    SYSTEM_PROMPT = "You are a helpful assistant. Keep your responses concise and friendly."
     
 class DevelopmentConfig(Config):
     """Development configuration"""
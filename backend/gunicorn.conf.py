@@ -0,0 +1,17 @@
+# Production server: run `gunicorn app:app` from the backend directory
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Import the app in the master process so the embedding model loaded in
+# when_ready is inherited by every forked worker instead of loaded N times.
+# Only CPU models are preloaded: CUDA can't be used in a forked child, so on
+# a GPU host each worker loads the model itself at startup.
+preload_app = True
+
+def when_ready(server):
+    from app import can_preload_embeddings, get_embeddings
+    if can_preload_embeddings():
+        get_embeddings()
@@ -0,0 +1,53 @@
+from collections import OrderedDict
+
+class HistoryCache:
+    """Up to `window` recent prompt messages of recently active sessions.
+
+    Each entry remembers the highest Message.id it has seen, so a turn only
+    fetches rows committed after that (normally just the previous turn)
+    instead of rebuilding the window from the database. The cursor is the
+    row id, not created_at: a turn is stamped when its request arrives but
+    committed after the response, possibly by another worker, so timestamps
+    don't become visible in order. Entries are only ever filled from
+    committed rows. Least recently used sessions are dropped beyond
+    `max_sessions`.
+
+    When an entry grows past `window` it is cut back to its newest
+    `window // 2` messages (at least one) in one go, rather than losing one
+    message per turn, so the prompt prefix built from it changes only every
+    few turns.
+    """
+
+    def __init__(self, window, max_sessions):
+        self.window = window
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+
+    def get(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry:
+            self._sessions.move_to_end(session_id)
+        return entry
+
+    def extend(self, session_id, rows):
+        """Append (Message.id, prompt message) pairs newer than the entry's cursor."""
+        entry = self._sessions.get(session_id)
+        if not entry:
+            entry = self._sessions[session_id] = {
+                "messages": [],
+                "last_id": None,
+            }
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        # Overlapping turns of one session can fetch the same delta; rows the
+        # entry already holds are skipped rather than appended twice
+        last_id = entry["last_id"]
+        rows = [(row_id, message) for row_id, message in rows if last_id is None or row_id > last_id]
+        entry["messages"].extend(message for _, message in rows)
+        if len(entry["messages"]) > self.window:
+            del entry["messages"][:len(entry["messages"]) - max(1, self.window // 2)]
+        if rows:
+            entry["last_id"] = max(row_id for row_id, _ in rows)
+
+    def evict(self, session_id):
+        self._sessions.pop(session_id, None)
@@ -0,0 +1,115 @@
+import os
+import logging
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from filelock import FileLock
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+
+class OnnxEmbeddings(Embeddings):
+    """Sentence-transformer encoder running as a dynamically int8-quantized ONNX model.
+
+    On first use the model is exported with optimum and quantized for
+    AVX-512 VNNI into `cache_dir`; later starts load the quantized file
+    directly. The export holds a lock next to `cache_dir` and only moves
+    the finished model into place, so concurrent workers never export twice
+    or load a partly written file. Mean pooling and L2 normalization match the
+    sentence-transformers pipeline, so vectors stay interchangeable (up to
+    quantization error) with the PyTorch HuggingFaceEmbeddings.
+
+    Requires `pip install optimum[onnxruntime]`.
+    """
+
+    def __init__(self, model_name, cache_dir, batch_size=32, max_length=256):
+        try:
+            import onnxruntime  # noqa: F401 (fail early if missing)
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError(
+                "EMBEDDING_BACKEND=onnx requires optimum[onnxruntime]; "
+                "install it with `pip install optimum[onnxruntime]`"
+            ) from e
+
+        self.batch_size = batch_size
+        self.max_length = max_length
+
+        model_path = os.path.join(cache_dir, QUANTIZED_MODEL_FILE)
+        os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+        with FileLock(f"{cache_dir}.lock"):
+            if not os.path.exists(model_path):
+                export_quantized_model(model_name, cache_dir)
+
+        self.model_path = model_path
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
+
+    def _get_session(self):
+        # ONNX Runtime's thread pool doesn't survive fork, so each process
+        # builds its own session on first use rather than inheriting one
+        if self._session_pid != os.getpid():
+            with self._session_lock:
+                if self._session_pid != os.getpid():
+                    import onnxruntime as ort
+                    self._session = ort.InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+                    self._session_pid = os.getpid()
+        return self._session
+
+    def _embed(self, texts):
+        session = self._get_session()
+        input_names = {i.name for i in session.get_inputs()}
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            inputs = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_length,
+                return_tensors="np",
+            )
+            feed = {name: value.astype(np.int64) for name, value in inputs.items() if name in input_names}
+            token_embeddings = session.run(None, feed)[0]
+
+            # Mean pooling over real tokens, then L2 normalization
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed(list(texts))
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+def export_quantized_model(model_name, cache_dir):
+    from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    logger.info(f"Exporting {model_name} to int8 ONNX in {cache_dir}")
+    # Build the export next to its destination (same filesystem) and swap it
+    # in whole; anything left in cache_dir is from an interrupted older export
+    tmp_dir = tempfile.mkdtemp(prefix=".export-", dir=os.path.dirname(cache_dir))
+    try:
+        model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+        model.save_pretrained(tmp_dir)
+        quantizer = ORTQuantizer.from_pretrained(tmp_dir)
+        quantizer.quantize(
+            save_dir=tmp_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False),
+        )
+        if os.path.exists(cache_dir):
+            shutil.rmtree(cache_dir)
+        os.replace(tmp_dir, cache_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
@@ -0,0 +1,47 @@
+import unittest
+
+from history_cache import HistoryCache
+
+class HistoryCacheTest(unittest.TestCase):
+    def test_extend_advances_cursor(self):
+        cache = HistoryCache(window=12, max_sessions=8)
+        cache.extend("s", [(1, "u1"), (2, "a1")])
+        cache.extend("s", [])
+        self.assertEqual(cache.get("s"), {"messages": ["u1", "a1"], "last_id": 2})
+
+    def test_extend_skips_rows_already_seen(self):
+        # Two overlapping turns of one session fetch the same delta
+        cache = HistoryCache(window=12, max_sessions=8)
+        cache.extend("s", [(1, "u1"), (2, "a1")])
+        cache.extend("s", [(3, "u2"), (4, "a2")])
+        cache.extend("s", [(3, "u2"), (4, "a2")])
+        self.assertEqual(cache.get("s"), {"messages": ["u1", "a1", "u2", "a2"], "last_id": 4})
+
+    def test_extend_keeps_only_newer_rows_of_a_partial_overlap(self):
+        cache = HistoryCache(window=12, max_sessions=8)
+        cache.extend("s", [(1, "u1"), (2, "a1")])
+        cache.extend("s", [(2, "a1"), (3, "u2"), (4, "a2")])
+        self.assertEqual(cache.get("s")["messages"], ["u1", "a1", "u2", "a2"])
+
+    def test_window_slides_in_blocks(self):
+        cache = HistoryCache(window=4, max_sessions=8)
+        cache.extend("s", [(i, f"m{i}") for i in range(1, 5)])
+        cache.extend("s", [(5, "m5")])
+        self.assertEqual(cache.get("s")["messages"], ["m4", "m5"])
+
+    def test_window_of_one_keeps_latest_message(self):
+        cache = HistoryCache(window=1, max_sessions=8)
+        cache.extend("s", [(1, "u1"), (2, "a1")])
+        self.assertEqual(cache.get("s")["messages"], ["a1"])
+
+    def test_least_recently_used_session_is_dropped(self):
+        cache = HistoryCache(window=12, max_sessions=2)
+        cache.extend("a", [(1, "a1")])
+        cache.extend("b", [(2, "b1")])
+        cache.get("a")
+        cache.extend("c", [(3, "c1")])
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+
+if __name__ == "__main__":
+    unittest.main()
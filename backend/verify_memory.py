@@ -1,35 +1,55 @@
-import requests
-import json
+import asyncio
+import os
 import time
 
-BASE_URL = "http://localhost:5000"
+import httpx
 
-def test_memory():
-    # Make sure backend is running (I'll assume it is as per terminal history)
-    session_id = f"test_session_{int(time.time())}"
-    
+BASE_URL = os.getenv("BASE_URL", "http://localhost:5000")
+TIMEOUT = float(os.getenv("VERIFY_TIMEOUT", "60"))
+# Number of independent sessions checked concurrently
+SESSIONS = int(os.getenv("VERIFY_SESSIONS", "1"))
+
+async def test_memory(client, session_id):
+    # Messages within a session must stay sequential: the second one checks
+    # that the first was remembered
     print(f"--- Testing Session: {session_id} ---")
-    
+
     # Message 1
     msg1 = {"message": "My name is Antigravity", "sessionId": session_id}
-    print(f"Sending: {msg1['message']}")
-    r1 = requests.post(f"{BASE_URL}/chat", json=msg1)
-    print(f"Response 1: {r1.json().get('response')}\n")
-    
+    print(f"[{session_id}] Sending: {msg1['message']}")
+    r1 = await client.post("/chat", json=msg1)
+    print(f"[{session_id}] Response 1: {r1.json().get('response')}\n")
+
     # Message 2
     msg2 = {"message": "What is my name?", "sessionId": session_id}
-    print(f"Sending: {msg2['message']}")
-    r2 = requests.post(f"{BASE_URL}/chat", json=msg2)
+    print(f"[{session_id}] Sending: {msg2['message']}")
+    r2 = await client.post("/chat", json=msg2)
     response2 = r2.json().get('response')
-    print(f"Response 2: {response2}")
-    
-    if "Antigravity" in response2:
-        print("\n✅ MEMORY TEST PASSED!")
-    else:
-        print("\n❌ MEMORY TEST FAILED!")
+    print(f"[{session_id}] Response 2: {response2}")
+
+    if response2 and "Antigravity" in response2:
+        print(f"\n✅ [{session_id}] MEMORY TEST PASSED!")
+        return True
+    print(f"\n❌ [{session_id}] MEMORY TEST FAILED!")
+    return False
+
+async def main():
+    # Make sure backend is running
+    run_id = int(time.time())
+    # One pooled client: keep-alive connections are reused across all requests
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=TIMEOUT) as client:
+        results = await asyncio.gather(*[
+            test_memory(client, f"test_session_{run_id}_{i}") for i in range(SESSIONS)
+        ])
+    print(f"\n{sum(results)}/{len(results)} sessions passed")
 
 if __name__ == "__main__":
     try:
-        test_memory()
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+    try:
+        run(main())
     except Exception as e:
         print(f"Error: {e}")
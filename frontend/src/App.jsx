@@ -99,11 +99,41 @@ function App() {
     setIsLoading(true)
 
     try {
-      const res = await axios.post(`${API_URL}/chat`, {
-        message,
-        sessionId: currentSessionId
+      // Server-sent events: render tokens as they arrive instead of waiting
+      // for the whole answer
+      const res = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ message, sessionId: currentSessionId })
       })
-      setMessages(prev => [...prev, { role: 'assistant', content: res.data.response }])
+      if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`)
+
+      const reader = res.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+      let started = false
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        const events = buffer.split('\n\n')
+        buffer = events.pop()
+        for (const event of events) {
+          if (!event.startsWith('data: ')) continue
+          const data = JSON.parse(event.slice(6))
+          if (data.error) throw new Error(data.error)
+          if (!data.token) continue
+          if (!started) {
+            started = true
+            setMessages(prev => [...prev, { role: 'assistant', content: data.token }])
+          } else {
+            setMessages(prev => {
+              const last = prev[prev.length - 1]
+              return [...prev.slice(0, -1), { ...last, content: last.content + data.token }]
+            })
+          }
+        }
+      }
     } catch (error) {
       setMessages(prev => [...prev, { role: 'assistant', content: "❌ Connection Error" }])
     } finally {
@@ -252,7 +282,7 @@ function App() {
               </motion.div>
             ))}
           </AnimatePresence>
-          {isLoading && (
+          {isLoading && messages[messages.length - 1]?.role !== 'assistant' && (
             <div className="message assistant">
               <div className="message-avatar"><Bot size={18} /></div>
               <div className="message-content">